@@ -14,25 +14,598 @@ Example:
     
     $ p.measurements.update_measurements()
     $ p.pqube_log()
+    
+    Several devices can be polled concurrently with asyncio:
+    $ asyncio.run(async_update_measurements([p.measurements, p2.measurements]))
 """
 
-from pyModbusTCP import utils
+import asyncio
+import socket
+import struct
+import time
+from array import array
+from functools import lru_cache
+from operator import attrgetter
+
+from pyModbusTCP import constants
 from pyModbusTCP.client import ModbusClient
 
+# PipelinedModbusClient builds on the socket and frame helpers of the 
+# pyModbusTCP 0.1 ModbusClient, which 0.2 reworked.
+if not constants.VERSION.startswith("0.1."):
+    raise ImportError("pqube needs pyModbusTCP 0.1.x, found " + 
+                      constants.VERSION + ", see requirements.txt.")
+
+
+# Modbus limits a single read request to 125 registers.
+MAX_REGS_PER_READ = 125
+FLOAT_REGS = 2    # each measurement is an IEEE-754 float over two registers
+
+
+_F32 = struct.Struct(">f")
+_WORDS_2 = struct.Struct(">HH")
+
 
 def convert_to_long(input):
-    long_32 = utils.word_list_to_long(input,True)
-    return utils.decode_ieee(long_32[0])
+    """Decodes two registers (high word first) into an IEEE-754 float."""
+    return _F32.unpack(_WORDS_2.pack(input[0], input[1]))[0]
+
+
+@lru_cache(maxsize=None)
+def _block_structs(count):
+    """Private: Returns the (registers, floats) Struct pair of a block of 
+    count floats, compiled once per block size."""
+    return (struct.Struct(">%dH" % (count * FLOAT_REGS)), 
+            struct.Struct(">%df" % count))
+
+
+def decode_floats(words):
+    """Decodes a register list, or the raw big-endian register bytes of a
+    response, into IEEE-754 floats, two registers (high word first) per
+    value, with a single unpack over the whole block."""
+    if isinstance(words, bytes):
+        count = len(words) // (2 * FLOAT_REGS)
+        return _block_structs(count)[1].unpack_from(words)
+    count = len(words) // FLOAT_REGS
+    words_struct, floats_struct = _block_structs(count)
+    return floats_struct.unpack(
+            words_struct.pack(*words[:count * FLOAT_REGS]))
+
+
+def _registers(data):
+    """Private: Returns the register list of raw big-endian register
+    bytes, None for None."""
+    if data is None:
+        return None
+    return list(struct.unpack(">%dH" % (len(data) // 2), data))
+
+
+def _block_results(results, raw):
+    """Private: Returns the results of a pipelined read as read_blocks 
+    does: None for a failed block, the register bytes if raw, otherwise 
+    the register list."""
+    results = [None if isinstance(data, Exception) else data 
+               for data in results]
+    return results if raw else [_registers(data) for data in results]
+
+
+def _check_max_regs(max_regs, name):
+    """Private: Raises ValueError unless max_regs, the argument name, is a
+    valid number of registers per read request."""
+    if not FLOAT_REGS <= max_regs <= MAX_REGS_PER_READ:
+        raise ValueError(name + " must be between " + str(FLOAT_REGS) + 
+                         " and " + str(MAX_REGS_PER_READ) + ".")
 
+
+def plan_register_reads(register_ids, max_regs=MAX_REGS_PER_READ, max_gap=0):
+    """Groups float register addresses into contiguous block reads.
+    
+    Registers are merged into one block while the hole between them is at
+    most max_gap registers and the block stays within max_regs registers.
+    Unused registers inside a block are read and discarded, which is
+    cheaper than another round-trip to the device. Every register of a
+    block sits an even number of registers after its start, so the block
+    decodes as a whole with decode_floats.
+    
+    Returns a list of (start_register, register_count, register_ids)
+    tuples, one per read_input_registers request.
+    """
+    _check_max_regs(max_regs, "max_regs")
+    plan = []
+    for reg_id in sorted(set(register_ids)):
+        if plan:
+            start, count, ids = plan[-1]
+            end = reg_id + FLOAT_REGS
+            if (reg_id - (start + count) <= max_gap and 
+                    end - start <= max_regs and
+                    (reg_id - start) % FLOAT_REGS == 0):
+                ids.append(reg_id)
+                plan[-1] = (start, max(count, end - start), ids)
+                continue
+        plan.append((reg_id, FLOAT_REGS, [reg_id]))
+    return plan
+
+
+class ModbusExceptionError(ValueError):
+    """Raised when the device answers a read with a Modbus exception 
+    response: the connection is fine, but the device refused the request,
+    e.g. exception_code 2 for an illegal data address.
+    
+    Attributes:
+        |  function_code: function code of the refused request.
+        |  exception_code: Modbus exception code sent by the device.
+        |  reg_addr: first register of the refused read.
+        |  reg_nb: number of registers of the refused read.
+    """
+    
+    def __init__(self, function_code, exception_code, reg_addr, reg_nb):
+        self.function_code = function_code
+        self.exception_code = exception_code
+        self.reg_addr = reg_addr
+        self.reg_nb = reg_nb
+        ValueError.__init__(self, "The PQube device refused reading " + 
+                            str(reg_nb) + " registers from " + 
+                            str(reg_addr) + " (function code " + 
+                            str(function_code) + ", Modbus exception code " + 
+                            str(exception_code) + ").")
+
+
+class PipelinedModbusClient(ModbusClient):
+    """ModbusClient able to pipeline several register reads.
+    
+    Modbus/TCP tags each request with a transaction ID, so several 
+    requests can be in flight on one connection. pipeline_read sends all
+    its requests back-to-back and then collects the responses by 
+    transaction ID: one network round-trip instead of one per request.
+    Responses with a protocol ID other than 0, or another unit ID, are
+    ignored.
+
+    async_pipeline_read does the same over an asyncio connection, so 
+    several devices can be polled concurrently from one event loop. The
+    blocking connection is closed when the asyncio one opens, and the 
+    asyncio connection is closed when its event loop shuts down (e.g. at
+    the end of asyncio.run), so a device only sees one connection.
+    
+    A dropped connection is reopened on the next read; while the device
+    keeps refusing connections, reconnect attempts back off exponentially
+    from RECONNECT_BACKOFF_S up to RECONNECT_BACKOFF_MAX_S seconds.
+    
+    Some devices reject several requests in flight on one connection: 
+    with strict_compliance=True the blocks are read one request at a 
+    time, still on the same connection.
     
-class LinePQube(ModbusClient):
+    The connection is kept open between reads, with TCP_NODELAY so small
+    requests go out at once and TCP keepalive so a dead device is noticed
+    after keepalive_idle + keepalive_cnt * keepalive_intvl seconds (on 
+    Linux) instead of the system default of hours.
+    
+    Attributes:
+        |  strict_compliance: one request in flight at a time. Default False.
+        |  keepalive_idle: idle seconds before the first keepalive probe.
+        |  keepalive_intvl: seconds between keepalive probes.
+        |  keepalive_cnt: unanswered probes before the connection drops.
+    
+    Methods:
+        |  open: open the TCP connection, with the socket options above.
+        |  pipeline_read: read several register blocks in one round-trip.
+        |  read_blocks: pipeline_read, retrying once on a dropped connection,
+           raising for a block that could not be read.
+        |  async_pipeline_read: coroutine version of pipeline_read.
+        |  async_read_blocks: coroutine version of read_blocks.
+        |  async_close: close the asyncio connection.
+    """
+    
+    MBAP_SIZE = 7    # transaction id, protocol id, length, unit id
+    RECONNECT_BACKOFF_S = 0.5
+    RECONNECT_BACKOFF_MAX_S = 30.0
+    KEEPALIVE_IDLE_S = 10
+    KEEPALIVE_INTVL_S = 5
+    KEEPALIVE_CNT = 3
+    
+    def __init__(self, *args, strict_compliance=False, 
+                 keepalive_idle=KEEPALIVE_IDLE_S, 
+                 keepalive_intvl=KEEPALIVE_INTVL_S, 
+                 keepalive_cnt=KEEPALIVE_CNT, **kwargs):
+        self.strict_compliance = strict_compliance
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_intvl = keepalive_intvl
+        self.keepalive_cnt = keepalive_cnt
+        ModbusClient.__init__(self, *args, **kwargs)
+        self._tr_id = 0
+        self._async_conn = None    # (event loop, reader, writer, guard)
+        self._reconnect_backoff_s = self.RECONNECT_BACKOFF_S
+        self._reconnect_at = 0.0    # time.monotonic() of the next attempt
+    
+    def _tune_socket(self, sock):
+        """Private: Sets TCP_NODELAY and TCP keepalive on a connected 
+        socket, as far as the platform supports them."""
+        options = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                   (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        for name, value in (("TCP_KEEPIDLE", self.keepalive_idle),
+                            ("TCP_KEEPINTVL", self.keepalive_intvl),
+                            ("TCP_KEEPCNT", self.keepalive_cnt)):
+            if hasattr(socket, name):
+                options.append((socket.IPPROTO_TCP, getattr(socket, name), 
+                                value))
+        for level, option, value in options:
+            try:
+                sock.setsockopt(level, option, value)
+            except OSError:
+                pass
+    
+    def open(self):
+        """Connect to the device like ModbusClient.open, setting 
+        TCP_NODELAY and TCP keepalive on the socket. Returns True if 
+        open."""
+        if not ModbusClient.open(self):
+            return False
+        sock = getattr(self, "_ModbusClient__sock", None)
+        if sock is not None:
+            self._tune_socket(sock)
+        return True
+    
+    def _connect_allowed(self):
+        """Private: Returns False while backing off from a failed connect."""
+        return time.monotonic() >= self._reconnect_at
+    
+    def _connect_done(self, success):
+        """Private: Resets or extends the reconnect backoff."""
+        if success:
+            self._reconnect_backoff_s = self.RECONNECT_BACKOFF_S
+            self._reconnect_at = 0.0
+        else:
+            self._reconnect_at = time.monotonic() + self._reconnect_backoff_s
+            self._reconnect_backoff_s = min(2 * self._reconnect_backoff_s, 
+                                            self.RECONNECT_BACKOFF_MAX_S)
+    
+    def _reconnect(self):
+        """Private: Opens the connection unless backing off. Returns True 
+        if the connection is open."""
+        if not self.is_open() and self._connect_allowed():
+            self._connect_done(self.open())
+        return self.is_open()
+    
+    def _read_requests(self, blocks):
+        """Private: Returns the request frames for the blocks and a 
+        {transaction_id: block index} dict of the pending responses."""
+        pending = {}
+        frames = []
+        for i, (reg_addr, reg_nb) in enumerate(blocks):
+            if not (0 < reg_nb <= MAX_REGS_PER_READ):
+                continue
+            self._tr_id = (self._tr_id + 1) & 0xffff
+            pending[self._tr_id] = i
+            frames.append(struct.pack(">HHHBBHH", self._tr_id, 0, 6, 
+                                      self.unit_id(), 
+                                      constants.READ_INPUT_REGISTERS, 
+                                      reg_addr, reg_nb))
+        return b"".join(frames), pending
+    
+    def _read_response(self, blocks, pending, results, mbap, body):
+        """Private: Stores the register bytes of a response body in 
+        results, or a ModbusExceptionError for an exception response. 
+        mbap is the unpacked (transaction id, protocol id, length, unit id)
+        header."""
+        tr_id, protocol_id, _, unit_id = mbap
+        if protocol_id != 0 or unit_id != self.unit_id():
+            return    # not a Modbus/TCP response of our unit
+        i = pending.pop(tr_id, None)
+        if i is None:    # not one of ours, e.g. a late response
+            return
+        reg_addr, reg_nb = blocks[i]
+        function_code = constants.READ_INPUT_REGISTERS
+        if (body[0] == function_code and 
+                body[1] == 2 * reg_nb == len(body) - 2):
+            results[i] = body[2:]
+        elif body[0] == function_code | 0x80 and len(body) == 2:
+            results[i] = ModbusExceptionError(function_code, body[1], 
+                                              reg_addr, reg_nb)
+    
+    def _check_results(self, results):
+        """Private: Raises the exception response of a block, or 
+        ConnectionError if a block was not read at all."""
+        for result in results:
+            if isinstance(result, ModbusExceptionError):
+                raise result
+        if None in results:
+            raise ConnectionError("Reading registers from the PQube device " +
+                                  "at " + str(self.host()) + " failed.")
+    
+    def pipeline_read(self, blocks, raw=False):
+        """Reads the input registers of several (reg_addr, reg_nb) blocks.
+        
+        Returns a list holding the registers list of each block, or None
+        for a block that failed, like read_input_registers. With raw=True
+        a block holds the big-endian register bytes of the response 
+        instead, for decode_floats.
+        """
+        return _block_results(self._read_all(blocks), raw)
+    
+    def _read_all(self, blocks):
+        """Private: Returns the raw results of the blocks, see 
+        _read_response, in flight together unless strict_compliance."""
+        if self.strict_compliance:
+            return [self._pipeline_read([block])[0] for block in blocks]
+        return self._pipeline_read(blocks)
+    
+    def _pipeline_read(self, blocks):
+        """Private: pipeline_read of the raw register bytes, with all the
+        requests in flight."""
+        results = [None] * len(blocks)
+        if self.auto_open() and not self._reconnect():
+            return results
+        frame, pending = self._read_requests(blocks)
+        if not pending:
+            return results
+        if not self._send(frame):
+            return results
+        if self.debug():
+            self._pretty_dump("Tx", frame)
+        while pending:
+            header = self._recv_all(self.MBAP_SIZE)
+            if not header:
+                break
+            mbap = struct.unpack(">HHHB", header)
+            length = mbap[2]
+            body = self._recv_all(length - 1) if length > 2 else None
+            if not body:
+                break
+            if self.debug():
+                self._pretty_dump("Rx", header + body)
+            self._read_response(blocks, pending, results, mbap, body)
+        if pending:
+            self.close()
+        elif self.auto_close():
+            self.close()
+        return results
+    
+    def read_blocks(self, blocks, raw=False):
+        """Reads several (reg_addr, reg_nb) blocks like pipeline_read, 
+        retrying once on a new connection if the connection dropped.
+        
+        Raises ModbusExceptionError if the device answered a block with an
+        exception response, ConnectionError if a block still could not be
+        read.
+        """
+        results = self._read_all(blocks)
+        if None in results and not self.is_open():
+            results = self._read_all(blocks)
+        self._check_results(results)
+        return _block_results(results, raw)
+    
+    async def _async_open(self):
+        """Private: Returns the (reader, writer) of the asyncio connection,
+        connecting on first use from the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_conn is None or self._async_conn[0] is not loop:
+            self.async_close()    # opened from another event loop
+            if not self._connect_allowed():
+                raise ConnectionError("backing off from a failed connect")
+            try:
+                reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host(), self.port()),
+                        self.timeout())
+            except (OSError, asyncio.TimeoutError):
+                self._connect_done(False)
+                raise
+            self._connect_done(True)
+            sock = writer.get_extra_info("socket")
+            if sock is not None:
+                self._tune_socket(sock)
+            if self.is_open():    # one connection per device
+                self.close()
+            guard = self._async_guard(writer)
+            await guard.__anext__()
+            self._async_conn = (loop, reader, writer, guard)
+        return self._async_conn[1:3]
+    
+    @staticmethod
+    async def _async_guard(writer):
+        """Private: Async generator closing writer when finalized: the 
+        event loop finalizes it when shutting down its async generators,
+        while it can still close the transport."""
+        try:
+            yield
+        finally:
+            writer.close()
+    
+    def async_close(self):
+        """Close the asyncio connection, if open."""
+        if self._async_conn is not None:
+            writer = self._async_conn[2]
+            self._async_conn = None
+            try:
+                writer.transport.abort()
+            except RuntimeError:
+                # loop closed without finalizing the guard: the transport
+                # can no longer be closed cleanly
+                pass
+    
+    async def async_pipeline_read(self, blocks, raw=False):
+        """Coroutine: Reads the input registers of several 
+        (reg_addr, reg_nb) blocks, see pipeline_read."""
+        return _block_results(await self._async_read_all(blocks), raw)
+    
+    async def _async_read_all(self, blocks):
+        """Private: Coroutine version of _read_all."""
+        if self.strict_compliance:
+            return [(await self._async_pipeline_read([block]))[0] 
+                    for block in blocks]
+        return await self._async_pipeline_read(blocks)
+    
+    async def _async_pipeline_read(self, blocks):
+        """Private: async_pipeline_read of the raw register bytes, with 
+        all the requests in flight."""
+        results = [None] * len(blocks)
+        frame, pending = self._read_requests(blocks)
+        if not pending:
+            return results
+        try:
+            reader, writer = await self._async_open()
+            writer.write(frame)
+            await writer.drain()
+            while pending:
+                header = await asyncio.wait_for(
+                        reader.readexactly(self.MBAP_SIZE), self.timeout())
+                mbap = struct.unpack(">HHHB", header)
+                length = mbap[2]
+                if length <= 2:
+                    break
+                body = await asyncio.wait_for(
+                        reader.readexactly(length - 1), self.timeout())
+                self._read_response(blocks, pending, results, mbap, body)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        if pending:
+            self.async_close()
+        return results
+    
+    async def async_read_blocks(self, blocks, raw=False):
+        """Coroutine: Reads several (reg_addr, reg_nb) blocks, see 
+        read_blocks."""
+        results = await self._async_read_all(blocks)
+        if None in results and self._async_conn is None:
+            results = await self._async_read_all(blocks)
+        self._check_results(results)
+        return _block_results(results, raw)
+
+
+def read_planned_blocks(client, plan):
+    """Reads every block of a plan from plan_register_reads and returns the
+    decoded values of each block, see locate_registers.
+    
+    Blocks are pipelined in one round-trip, with reconnection, and decoded
+    straight from the response bytes when the client is a 
+    PipelinedModbusClient.
+    """
+    blocks = [(start, count) for start, count, _ in plan]
+    if isinstance(client, PipelinedModbusClient):
+        block_words = client.read_blocks(blocks, raw=True)
+    else:
+        block_words = [client.read_input_registers(start, count)
+                       for start, count in blocks]
+    return [decode_floats(words) for words in block_words]
+
+
+async def async_update_measurements(devices):
+    """Coroutine: Updates the measurements of several PQube configuration
+    objects (e.g. PQube.measurements) concurrently, so the total poll 
+    time follows the slowest device instead of the sum of all of them."""
+    await asyncio.gather(*(device.async_update_measurements() 
+                           for device in devices))
+
+    
+def locate_registers(plan, register_ids):
+    """Returns the (block index, value index) of each register in the 
+    decoded blocks of a plan from plan_register_reads."""
+    positions = {}
+    for b, (start, _, reg_ids) in enumerate(plan):
+        for reg_id in reg_ids:
+            positions[reg_id] = (b, (reg_id - start) // FLOAT_REGS)
+    return [positions[reg_id] for reg_id in register_ids]
+
+
+def _register_item(index):
+    """Returns a read-only property of register id index of the _reg_ids
+    array."""
+    def fget(self):
+        return self._reg_ids[index]
+    return property(fget)
+
+
+def _measurement_item(index):
+    """Returns a property reading and writing measurement index of the 
+    _vals array, decoding the blocks last read by the device first."""
+    def fget(self):
+        if self._device is not None and self._tick != self._device._tick:
+            self._decode()
+        return self._vals[index]
+    def fset(self, value):
+        if self._device is not None and self._tick != self._device._tick:
+            self._decode()
+        self._vals[index] = value
+    return property(fget, fset)
+
+
+class _LineMeasurements(object):
+    """Private: Base of the line classes. The measurements and their 
+    register ids are compact arrays indexed like _FIELDS, exposed as 
+    attributes by properties, see _field_properties. The register ids
+    are read-only: the read plans are built from them at init.
+    
+    The measurements are always decoded from blocks read with a plan 
+    from plan_register_reads: the line's own plan for 
+    update_line_measurements, or the plan of the device it is bound to 
+    with bind_reads. In the latter case they are only decoded when first
+    accessed after each device update (device._tick), so measurements 
+    nobody reads are never decoded."""
+    
+    # (measurement attribute, register id attribute)
+    _FIELDS = ()
+    
+    __slots__ = ("_client", "_vals", "_reg_ids", "_read_plan", 
+                 "_plan_positions", "_device", "_positions", "_tick")
+    
+    def __init__(self, client, register_ids):
+        self._client = client
+        # doubles, so a value set by hand reads back unchanged
+        self._vals = array("d", [float('nan')] * len(self._FIELDS))
+        self._reg_ids = array("H", register_ids)
+        self._read_plan = plan_register_reads(self._reg_ids)
+        self._plan_positions = locate_registers(self._read_plan, 
+                                                self._reg_ids)
+        self._device = None
+        self._positions = ()
+        self._tick = 0
+        
+    def registers(self):
+        """Returns the register addresses holding the line measurements."""
+        return list(self._reg_ids)
+    
+    def bind_reads(self, device, plan):
+        """Decode the measurements from the blocks the device reads with
+        plan: device._raw, updated along with device._tick."""
+        self._device = device
+        self._positions = locate_registers(plan, self._reg_ids)
+        self._tick = device._tick
+    
+    def _set_values(self, blocks, positions):
+        """Private: Sets the measurements from decoded blocks."""
+        vals = self._vals
+        for i, (b, k) in enumerate(positions):
+            vals[i] = blocks[b][k]
+    
+    def _decode(self):
+        """Private: Sets the measurements from the device blocks."""
+        self._set_values(self._device._raw, self._positions)
+        self._tick = self._device._tick
+    
+    def update_line_measurements(self):
+        """Update all the measurements for the line, read on their own 
+        through the client."""
+        self._set_values(read_planned_blocks(self._client, self._read_plan),
+                         self._plan_positions)
+        if self._device is not None:    # newer than the device blocks
+            self._tick = self._device._tick
+
+
+def _field_properties(cls):
+    """Exposes the array items as the measurement/register attributes of
+    the _FIELDS of a _LineMeasurements class."""
+    for i, (attr, reg_attr) in enumerate(cls._FIELDS):
+        setattr(cls, attr, _measurement_item(i))
+        setattr(cls, reg_attr, _register_item(i))
+
+    
+class LinePQube(_LineMeasurements):
     """Class for line measurements in pQube device.
     
-    A subclass of ModbusClient, denoting one line on a split-single phase
-    distribution line. The measurements are collected by the pQube device
-    using the PQube class.
+    Denotes one line on a split-single phase distribution line. The 
+    measurements are collected by the pQube device using the PQube class,
+    sharing its ModbusClient connection.
     
     Attributes:
+        |  client: ModbusClient connected to the pQube device
         |  v_rms: RMS voltage of the line (V)
         |  v_mag_fundamental: Fundamental RMS voltage (V)
         |  v_angle_fundamental: Fundamental voltage phase angle (degrees)
@@ -48,125 +621,261 @@ class LinePQube(ModbusClient):
         |  i_register_id: Register address holding RMS current measurement
         
     Methods: 
+        |  registers: register addresses holding the line measurements.
         |  update_line_measurements: read all the data from the registers
-           addresses specified.
+           addresses specified, merging contiguous registers into one request.
     """
     
+    # (measurement attribute, register id attribute), in data logging order
+    _FIELDS = (("v_rms", "v_rms_register_id"),
+               ("v_mag_fundamental", "v_mag_fundamental_register_id"),
+               ("v_angle_funamental", "v_angle_fundamental_register_id"),
+               ("i_rms", "i_rms_register_id"),
+               ("i_mag_funamental", "i_mag_fundamental_register_id"),
+               ("i_angle_fundamental", "i_angle_fundamental_register_id"),
+               ("apparent_power", "s_register_id"),
+               ("real_power", "p_register_id"),
+               ("reactive_power", "q_register_id"),
+               ("v_thd", "v_thd_register_id"),
+               ("i_tdd", "i_tdd_register_id"))
+    MEAS_ATTRS = tuple(attr for attr, _ in _FIELDS)
+    
+    # no per-instance __dict__, the measurements live in _vals
+    __slots__ = ()
+    
     # constructors
-    def __init__(self, hostname="10.60.36.5" , port=502 ,auto_open=True, debug=False,
-                 v_rms_register_id=7008, v_mag_fundamental_register_id=7098,
+    def __init__(self, client, v_rms_register_id=7008, v_mag_fundamental_register_id=7098,
                  v_angle_fundamental_register_id=7100, i_rms_register_id=7028, 
                  i_mag_fundamental_register_id=7110, 
                  i_angle_fundamental_register_id=7112, 
                  s_register_id = 7210, p_register_id=7204,
                  q_register_id=7216, v_thd_register_id=7192, i_tdd_register_id=7198):
-        ModbusClient.__init__(self, host=hostname, port=port, auto_open=auto_open, debug=debug)
-        self.v_rms = float('nan')
-        self.v_mag_fundamental = float('nan')
-        self.v_angle_funamental = float('nan')
-        self.i_rms = float('nan')
-        self.i_mag_funamental = float('nan')
-        self.i_angle_fundamental = float('nan')
-        self.apparent_power = float('nan')
-        self.real_power = float('nan')
-        self.reactive_power = float('nan')
-        self.v_thd = float('nan')
-        self.i_tdd = float('nan')
-        self.v_rms_register_id = v_rms_register_id
-        self.v_mag_fundamental_register_id = v_mag_fundamental_register_id
-        self.v_angle_fundamental_register_id = v_angle_fundamental_register_id
-        self.i_rms_register_id = i_rms_register_id
-        self.i_mag_fundamental_register_id = i_mag_fundamental_register_id
-        self.i_angle_fundamental_register_id = i_angle_fundamental_register_id
-        self.s_register_id = s_register_id
-        self.p_register_id = p_register_id
-        self.q_register_id = q_register_id
-        self.v_thd_register_id = v_thd_register_id
-        self.i_tdd_register_id = i_tdd_register_id
-        
-        if auto_open:
-            self.open()
+        _LineMeasurements.__init__(self, client, [
+                v_rms_register_id, v_mag_fundamental_register_id,
+                v_angle_fundamental_register_id, i_rms_register_id,
+                i_mag_fundamental_register_id, 
+                i_angle_fundamental_register_id, s_register_id, 
+                p_register_id, q_register_id, v_thd_register_id, 
+                i_tdd_register_id])
         
     def __str__(self):
-        rep = ("V_RMS: " + str(self.v_rms) + " V\n" + \
-               "I_RMS: " + str(self.i_rms) + " A\n" + \
-               "Apparent Power: " + str(self.apparent_power) + " VA\n" + \
-               "Real Power: " + str(self.real_power) + " W\n" + \
-               "Reactive Power: " + str(self.reactive_power) + " VAR\n" + \
-               "Voltage THD: " + str(self.v_thd) + "%\n" + \
-               "Current TDD: " + str(self.i_tdd)) + "%"
+        rep = (f"V_RMS: {self.v_rms} V\n"
+               f"I_RMS: {self.i_rms} A\n"
+               f"Apparent Power: {self.apparent_power} VA\n"
+               f"Real Power: {self.real_power} W\n"
+               f"Reactive Power: {self.reactive_power} VAR\n"
+               f"Voltage THD: {self.v_thd}%\n"
+               f"Current TDD: {self.i_tdd}%")
         return rep
+
+
+_field_properties(LinePQube)
+
+
+class PQubeBase(PipelinedModbusClient):
+    """Base class of the PQube power configurations, holding the power
+    configuration check and the batched reads of the active lines.
+
+    Attributes:
+        |  hostname: Host IP address.
+        |  port: Comm port.
+        |  auto_open: Default True.
+        |  debug: Default False.
+        |  max_words_per_request: most registers read in one request, for
+           devices accepting less than the Modbus limit. Default 125.
+        |  min_poll_interval: seconds during which update_measurements 
+           keeps the last measurements instead of reading the device 
+           again. Default 0, read on every update.
+        |  strict_compliance: read the blocks one request at a time, for
+           devices rejecting pipelined requests. Default False.
+        |  keepalive_idle, keepalive_intvl, keepalive_cnt: TCP keepalive
+           idle seconds, probe interval and probe count, see 
+           PipelinedModbusClient. Default 10, 5, 3.
         
-    # methods
-    def __meas_v_rms(self):
-        """Private method: Returns RMS voltage for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.v_rms_register_id, 2))
-    
-    def __meas_v_mag_fundamental(self):
-        """Private method: Returns RMS voltage at fundamental frequency."""
-        return convert_to_long(
-                self.read_input_registers(self.v_mag_fundamental_register_id, 2))
-        
-    def __meas_v_angle_fundamental(self):
-        """Private: Returns Voltage phase angle at fundamental frequency."""
-        return convert_to_long(
-                self.read_input_registers(self.v_angle_fundamental_register_id, 2))
-        
-    def __meas_i_rms(self):
-        """Private method: Returns RMS Current for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.i_rms_register_id, 2))
-    
-    def __meas_i_mag_fundamental(self):
-        return convert_to_long(
-                self.read_input_registers(self.i_mag_fundamental_register_id, 2))
-        
-    def __meas_i_angle_fundamental(self):
-        return convert_to_long(
-                self.read_input_registers(self.i_angle_fundamental_register_id, 2))
-        
-    def __meas_apparent_power(self):
-        """Private mehtod: Returns apparent power measurements for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.s_register_id, 2))
-        
-    def __meas_real_power(self):
-        """Private method: Returns real power measurements for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.p_register_id, 2))
-        
-    def __meas_reactive_power(self):
-        """Private: Returns the reactive power measurement for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.q_register_id, 2))
-        
-    def __meas_v_thd(self):
-        """Private method: Returns voltage THD value for the line"""
-        return convert_to_long(
-                self.read_input_registers(self.v_thd_register_id, 2))
-        
-    def __meas_i_tdd(self):
-        """Private_method: Returns current TDD value for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.i_tdd_register_id, 2))
-        
-    def update_line_measurements(self):
-        """Update all the measurements for the line."""
-        self.v_rms = self.__meas_v_rms()
-        self.v_mag_fundamental = self.__meas_v_mag_fundamental()
-        self.v_angle_funamental = self.__meas_v_angle_fundamental()
-        self.i_rms = self.__meas_i_rms()
-        self.i_mag_funamental = self.__meas_i_mag_fundamental()
-        self.i_angle_fundamental = self.__meas_i_angle_fundamental()
-        self.apparent_power = self.__meas_apparent_power()
-        self.real_power = self.__meas_real_power()
-        self.reactive_power = self.__meas_reactive_power()
-        self.v_thd = self.__meas_v_thd()
-        self.i_tdd = self.__meas_i_tdd()
-        
-        
-class PQubeSplit1p(ModbusClient):
+        The configuration classes pass these options through as keyword
+        arguments.
+
+    Methods:
+        |  update_measurements: update the measured attributes from the lines.
+        |  pqube_phase_log: updates the measurements and returns as a list for
+           data logging purposes.
+        |  async_pqube_phase_log: coroutine version of pqube_phase_log.
+        |  pqube_phase_log_csv: same as pqube_phase_log, formatted as a 
+           CSV line.
+    """
+
+    REG_POWER_CONFIG = 8022
+    REG_FREQ = None    # frequency register, None if not collected
+    POWER_CONFIG = None    # power configuration id expected on the device
+    POWER_CONFIG_NAME = ""    # matching PQube power_config attribute
+    NO_LINES_MESSAGE = "No measurements specified."
+    READ_2_REG = 2    # read two registers
+    DEFAULT_MAX_WORDS = MAX_REGS_PER_READ
+
+    def __init__(self, hostname, port, auto_open, debug,
+                 max_words_per_request=DEFAULT_MAX_WORDS,
+                 min_poll_interval=0.0, **kwargs):
+        # fail before connecting to the device
+        _check_max_regs(max_words_per_request, "max_words_per_request")
+        PipelinedModbusClient.__init__(self, host=hostname, port=port,
+                                       auto_open=auto_open, debug=debug,
+                                       **kwargs)
+        self.max_words_per_request = max_words_per_request
+        self.min_poll_interval = min_poll_interval
+        self._last_update = float('-inf')    # time.monotonic() of the last read
+        # check power config on the device, cached as it never changes;
+        # ConnectionError naming the host if the device can't be read
+        self._power_config = self.read_blocks(
+                [(self.REG_POWER_CONFIG, 1)])[0][0]
+        if self._power_config != self.POWER_CONFIG:
+            print("Make sure the power configuration in the 'Setup.ini' file" +
+                  " matches the 'power_config = %s' attribute "
+                  % self.POWER_CONFIG_NAME + "in device initialization.")
+            self.close()
+            raise AttributeError
+        if self.REG_FREQ is not None:
+            self.freq = float('nan')
+        self._lines = []    # active lines, in logging order
+        self._labelled_lines = []    # (label, line) of the active lines
+        self._read_plan = []
+        self._blocks = []    # (start, count) of each block of _read_plan
+        self._raw = []    # decoded values of each block, as last read
+        self._tick = 0    # bumped on every read, see _LineMeasurements
+        self._row = []    # data log row, reused on every pqube_phase_log
+        self._log_slots = []
+        self._cell_fmts = []    # CSV format of each cell of the row
+        self._row_fmt = "\n"
+
+    def __str__(self):
+        if not self._labelled_lines:
+            return self.NO_LINES_MESSAGE
+        return "\n".join(f"{label}: \n{line}" 
+                         for label, line in self._labelled_lines)
+
+    def _add_line(self, label, line):
+        """Private: adds an active line, read by update_measurements."""
+        self._lines.append(line)
+        self._labelled_lines.append((label, line))
+
+    def meas_freq(self):
+        """Reads the frequency from the device and returns it. Raises 
+        ConnectionError if it can't be read. update_measurements reads it
+        into freq along with the line registers."""
+        if self.REG_FREQ is None:
+            raise AttributeError("The frequency is not collected in the " +
+                                 self.POWER_CONFIG_NAME + 
+                                 " power configuration.")
+        data = self.read_blocks([(self.REG_FREQ, self.READ_2_REG)], raw=True)
+        return decode_floats(data[0])[0]
+
+    def _log_layout(self, size):
+        """Private: sets up a data log row of size blank ("") values."""
+        self._row = [""] * size
+        self._log_slots = []
+        self._cell_fmts = ["%s"] * size
+        self._row_fmt = ",".join(self._cell_fmts) + "\n"
+
+    def _log_slot(self, first, src, attrs):
+        """Private: logs the attrs of src from index first of the row."""
+        last = first + len(attrs)
+        self._log_slots.append((first, last, src, attrgetter(*attrs)))
+        # 9 significant digits round-trip a float32 measurement
+        self._cell_fmts[first:last] = ["%.9g"] * (last - first)
+        self._row_fmt = ",".join(self._cell_fmts) + "\n"
+
+    def _plan_reads(self):
+        """Private: plans the reads of the frequency and the registers of
+        the active lines (self._lines), in as few requests as the device
+        accepts."""
+        registers = [] if self.REG_FREQ is None else [self.REG_FREQ]
+        for line in self._lines:
+            registers.extend(line.registers())
+        # a gap costs less than a round-trip: merge within the request size
+        self._read_plan = plan_register_reads(
+                registers, max_regs=self.max_words_per_request,
+                max_gap=self.max_words_per_request)
+        self._blocks = [(start, count) for start, count, _ in self._read_plan]
+        if self.REG_FREQ is not None:
+            self._freq_at = locate_registers(self._read_plan, 
+                                             [self.REG_FREQ])[0]
+        for line in self._lines:
+            line.bind_reads(self, self._read_plan)
+
+    def _load_blocks(self, block_words):
+        """Private: decodes the blocks read, the lines decode their 
+        measurements from them when accessed."""
+        self._raw = [decode_floats(words) for words in block_words]
+        self._tick += 1
+        if self.REG_FREQ is not None:
+            b, k = self._freq_at
+            self.freq = self._raw[b][k]
+
+    def _update_due(self):
+        """Private: Returns the poll time, None while the last measurements
+        are younger than min_poll_interval."""
+        now = time.monotonic()
+        if not self._lines or now - self._last_update < self.min_poll_interval:
+            return None
+        return now
+
+    def update_measurements(self):
+        """Update all the measurements, unless updated less than
+        min_poll_interval seconds ago."""
+        now = self._update_due()
+        if now is None:
+            return
+        self._load_blocks(self.read_blocks(self._blocks, raw=True))
+        # only a successful read starts a new interval
+        self._last_update = now
+
+    async def async_update_measurements(self):
+        """Coroutine version of update_measurements, over an asyncio
+        connection."""
+        now = self._update_due()
+        if now is None:
+            return
+        self._load_blocks(
+                await self.async_read_blocks(self._blocks, raw=True))
+        self._last_update = now
+
+    def force_refresh(self):
+        """Read the device on the next update, even within 
+        min_poll_interval."""
+        self._last_update = float('-inf')
+
+    def pqube_phase_log(self):
+        """Returns the attribute values of PQube measurements as a list for
+        data logging purposes, blank ("") for the measurements not
+        collected.
+        """
+        self.update_measurements()
+        return self._log_row().copy()
+
+    async def async_pqube_phase_log(self):
+        """Coroutine version of pqube_phase_log."""
+        await self.async_update_measurements()
+        return self._log_row().copy()
+
+    def pqube_phase_log_csv(self):
+        """Returns the values of pqube_phase_log as one CSV line, ending
+        with a newline, ready to be written to a log file."""
+        self.update_measurements()
+        return self._row_fmt % tuple(self._log_row())
+
+    def _log_row(self):
+        """Private: Returns the row buffer, filled with the current 
+        measurements."""
+        row = self._row
+        # the blank slots of the inactive lines are set once, at init
+        for first, last, src, get in self._log_slots:
+            if last - first == 1:
+                row[first] = get(src)
+            else:
+                row[first:last] = get(src)
+        return row
+
+
+class PQubeSplit1p(PQubeBase):
     """Class for data collection with PQube in Split single phase power
     configuration.
     
@@ -183,6 +892,7 @@ class PQubeSplit1p(ModbusClient):
            if meas_line1=True.
         |  line2: LinePQube object containing measurements from line2, 
            if meas_line2=True.
+        |  **kwargs: connection and polling options, see PQubeBase.
         
         Line attributes are: v_rms, i_rms, apparent_power, real_power, reactive_power, v_thd, i_tdd
     
@@ -192,7 +902,9 @@ class PQubeSplit1p(ModbusClient):
     """
     
     # register addresses as constants
-    REG_POWER_CONFIG = 8022
+    POWER_CONFIG = 2
+    POWER_CONFIG_NAME = "split_single_phase"
+    NO_LINES_MESSAGE = "No Line measurements specified."
     REG_FREQ = 7026
     REG_V_RMS_L1 = 7008
     REG_V_MAG_FUNDAMENTAL_L1 = 7098
@@ -216,25 +928,18 @@ class PQubeSplit1p(ModbusClient):
     REG_VA_L2 = 7212
     REG_VAR_FUNDAMENTAL_L1 = 7216
     REG_VAR_FUNDAMENTAL_L2 = 7218
-    READ_2_REG = 2    # read two registers
     
     # Constructors
     def __init__(self, hostname="10.60.36.5" , port=502 ,auto_open=True, 
-                 debug=False, meas_line1=False, meas_line2=False):
-        ModbusClient.__init__(self, host=hostname, port=port, 
-                              auto_open=auto_open, debug=debug)
+                 debug=False, meas_line1=False, meas_line2=False, 
+                 **kwargs):
+        PQubeBase.__init__(self, hostname, port, auto_open, debug, **kwargs)
         
         self.meas_line1 = meas_line1
         self.meas_line2 = meas_line2
-        # check power config on the device
-        if self.read_input_registers(self.REG_POWER_CONFIG)[0] != 2:
-            print("Make sure the power configuration in the 'Setup.ini' file" +
-                  " matches the 'power_config' attribute in device initialization.")
-            raise AttributeError
         if self.meas_line1:    # initialize line 1 measurements
             self.line1 = LinePQube(
-                    hostname=hostname, port=port,
-                    auto_open=auto_open, debug=debug,
+                    client=self,
                     v_rms_register_id=self.REG_V_RMS_L1,
                     v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL_L1,
                     v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL_L1,
@@ -249,8 +954,7 @@ class PQubeSplit1p(ModbusClient):
             
         if self.meas_line2:    # initialize line 2 measurements
             self.line2 = LinePQube(
-                    hostname=hostname, port=port,
-                    auto_open=auto_open, debug=debug,
+                    client=self,
                     v_rms_register_id=self.REG_V_RMS_L2,
                     v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL_L2,
                     v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL_L2,
@@ -263,121 +967,46 @@ class PQubeSplit1p(ModbusClient):
                     v_thd_register_id=self.REG_V_THD_L2,
                     i_tdd_register_id=self.REG_I_TDD_L2)
             
-        if self.meas_line1 or self.meas_line2:
-            self.freq = float('nan')
-            
-        if auto_open:
-            self.open()
-
-    def __str__(self):
-        if self.meas_line1 and self.meas_line2:
-            return "Line 1: \n" + str(self.line1) + "\nLine 2: \n" + str(self.line2)
-        elif self.meas_line1:
-            return "Line 1: \n" + str(self.line1)
-        elif self.meas_line2:
-            return "Line 2: \n" + str(self.line2)
-        else:
-            return "No Line measurements specified."
-    
-    # Methods    
-    def meas_freq(self):
-        """Returns the measured frequency."""
-        return convert_to_long(
-                self.read_input_registers(self.REG_FREQ, self.READ_2_REG))
-    
-    def update_measurements(self):
-        """Update the PQube measurements."""
         if self.meas_line1:
-            self.freq = self.meas_freq()
-            self.line1.update_line_measurements()
-            
+            self._add_line("Line 1", self.line1)
         if self.meas_line2:
-            self.freq = self.meas_freq()
-            self.line2.update_line_measurements()
-            
-    def pqube_phase_log(self):
-        """Returns the attribute values of PQube measurements as a list for 
-        data logging purposes.
-        """
-        self.update_measurements()
-        if self.meas_line1 and self.meas_line2:
-            values = [self.freq, self.line1.v_rms, 
-                      self.line1.v_mag_fundamental,
-                      self.line1.v_angle_funamental,
-                      self.line1.i_rms, 
-                      self.line1.i_mag_funamental,
-                      self.line1.i_angle_fundamental,
-                      self.line1.apparent_power, self.line1.real_power, 
-                      self.line1.reactive_power, self.line1.v_thd, 
-                      self.line1.i_tdd, self.line2.v_rms, 
-                      self.line2.v_mag_fundamental,
-                      self.line2.v_angle_funamental,
-                      self.line2.i_rms, 
-                      self.line2.i_mag_funamental,
-                      self.line2.i_angle_fundamental,
-                      self.line2.apparent_power, 
-                      self.line2.real_power, self.line2.reactive_power, 
-                      self.line2.v_thd, self.line2.i_tdd]
-        elif  self.meas_line1:
-            values = [self.freq, self.line1.v_rms, 
-                      self.line1.v_mag_fundamental,
-                      self.line1.v_angle_funamental,
-                      self.line1.i_rms, 
-                      self.line1.i_mag_funamental,
-                      self.line1.i_angle_fundamental,
-                      self.line1.apparent_power, self.line1.real_power, 
-                      self.line1.reactive_power, 
-                      self.line1.v_thd, self.line1.i_tdd]
-            values.extend([""]*11)
-        elif self.meas_line2:
-            values = self.freq
-            values.extend(list([""]*11))
-            values.extend([self.line2.v_rms, 
-                           self.line2.v_mag_fundamental,
-                           self.line2.v_angle_funamental,
-                           self.line2.i_rms, 
-                           self.line2.i_mag_funamental,
-                           self.line2.i_angle_fundamental,
-                           self.line2.apparent_power, self.line2.real_power, 
-                           self.line2.reactive_power, self.line2.v_thd, 
-                           self.line2.i_tdd])
-        else:
-            values = list([""]*23)
+            self._add_line("Line 2", self.line2)
+        self._plan_reads()
         
-        return values
+        # data log layout: freq, then 11 slots per line, blank if inactive
+        n_attrs = len(LinePQube.MEAS_ATTRS)
+        self._log_layout(1 + 2 * n_attrs)
+        if self._lines:
+            self._log_slot(0, self, ("freq",))
+        for first, active, name in ((1, self.meas_line1, "line1"),
+                                    (1 + n_attrs, self.meas_line2, "line2")):
+            if active:
+                self._log_slot(first, getattr(self, name), 
+                               LinePQube.MEAS_ATTRS)
     
 
-class LToLPQube(ModbusClient):
+class LToLPQube(_LineMeasurements):
     """Class for line measurements in pQube device in 3-phase Delta or
-    Single phase L1-L2 config."""
+    Single phase L1-L2 config, read through the ModbusClient (client) of
+    the owning PQube class."""
+    
+    # (measurement attribute, register id attribute)
+    _FIELDS = (("v_rms", "v_rms_register_id"),)
+    
+    __slots__ = ()
     
     # constructors
-    def __init__(self, hostname="10.60.36.6" , port=502,
-                 auto_open=True, debug=False,
-                 v_rms_register_id=7008):
-        ModbusClient.__init__(self, host=hostname, port=port, 
-                              auto_open=auto_open, debug=debug)
-        self.v_rms = float('nan')
-        self.v_rms_register_id = v_rms_register_id
-        if auto_open:
-            self.open()
+    def __init__(self, client, v_rms_register_id=7008):
+        _LineMeasurements.__init__(self, client, [v_rms_register_id])
         
     def __str__(self):
-        rep = "V_RMS: " + str(self.v_rms) + " V"
-        return rep
-        
-    # methods
-    def __meas_v_rms(self):
-        """Private method: Returns RMS voltage for the line."""
-        return convert_to_long(
-                self.read_input_registers(self.v_rms_register_id, 2))
-        
-    def update_line_measurements(self):
-        """Update all the measurements for the line."""
-        self.v_rms = self.__meas_v_rms()
+        return f"V_RMS: {self.v_rms} V"
+
 
+_field_properties(LToLPQube)
 
-class PQube3pDelta(ModbusClient):
+
+class PQube3pDelta(PQubeBase):
     """Class for data collection with PQube in 3 phase delta configuration.
     
     Attributes:
@@ -391,6 +1020,7 @@ class PQube3pDelta(ModbusClient):
         |  line1_line2: object containing L1-L2 measurements.
         |  line2_line3: object containing L2-L3 measurements.
         |  line3_line1: object containing L3-L1 measurements.
+        |  **kwargs: connection and polling options, see PQubeBase.
         
         L-L measurement attributes: v_rms
         
@@ -401,7 +1031,8 @@ class PQube3pDelta(ModbusClient):
     """
     
     # register addresses
-    REG_POWER_CONFIG = 8022
+    POWER_CONFIG = 4
+    POWER_CONFIG_NAME = "3p_delta"
     REG_V_L1_L2 = 7014
     REG_V_L2_L3 = 7016
     REG_V_L3_L1 = 7018
@@ -409,96 +1040,39 @@ class PQube3pDelta(ModbusClient):
     # constructors
     def __init__(self, hostname="10.60.36.6" , port=502 ,auto_open=True, 
                  debug=False, meas_line1_line2=False, 
-                 meas_line2_line3=False, meas_line3_line1=False):
+                 meas_line2_line3=False, meas_line3_line1=False, **kwargs):
         """Inits PQube3pDelta."""
-        ModbusClient.__init__(self, host=hostname, port=port, 
-                              auto_open=auto_open, debug=debug)
+        PQubeBase.__init__(self, hostname, port, auto_open, debug, **kwargs)
         self.meas_line1_line2 = meas_line1_line2
         self.meas_line2_line3 = meas_line2_line3
         self.meas_line3_line1 = meas_line3_line1
-        # check power config on pqube
-        if self.read_input_registers(self.REG_POWER_CONFIG)[0] != 4:
-            print("Make sure the power configuration in the 'Setup.ini' file" +
-                  " matches the 'power_config' attribute in device initialization.")
-            raise AttributeError
         if self.meas_line1_line2:
-            self.line1_line2 = LToLPQube(hostname=hostname, port=port,
-                                                auto_open=auto_open,
-                                                debug=debug,
-                                                v_rms_register_id=self.REG_V_L1_L2)
+            self.line1_line2 = LToLPQube(client=self,
+                                         v_rms_register_id=self.REG_V_L1_L2)
         if self.meas_line2_line3:
-            self.line2_line3 = LToLPQube(hostname=hostname, port=port,
-                                                auto_open=auto_open,
-                                                debug=debug,
-                                                v_rms_register_id=self.REG_V_L2_L3)
+            self.line2_line3 = LToLPQube(client=self,
+                                         v_rms_register_id=self.REG_V_L2_L3)
         if self.meas_line3_line1:
-            self.line3_line1 = LToLPQube(hostname=hostname, port=port,
-                                                auto_open=auto_open,
-                                                debug=debug,
-                                                v_rms_register_id=self.REG_V_L3_L1)
-        if auto_open:
-            self.open()
-            
-    def __str__(self):
-        if self.meas_line1_line2 and self.meas_line2_line3 and self.meas_line3_line1:
-            return ("L1-L2: \n" + str(self.line1_line2) +
-                    "L2-L3: \n" + str(self.line2_line3) +
-                    "L3-L1: \n" + str(self.line3_line1))
-        elif self.meas_line1_line2 and self.meas_line2_line3:
-            return ("L1-L2: \n" + str(self.line1_line2) +
-                    "L2-L3: \n" + str(self.line2_line3))
-        elif self.meas_line2_line3 and self.meas_line3_line1:
-            return ("L2-L3: \n" + str(self.line2_line3) +
-                    "L3-L1: \n" + str(self.line3_line1))
-        elif self.meas_line3_line1 and self.meas_line1_line2:
-            return ("L1-L2: \n" + str(self.line1_line2) +
-                    "L3-L1: \n" + str(self.line3_line1))
-        elif self.meas_line1_line2:
-            return "L1-L2: \n" + str(self.line1_line2)
-        elif self.meas_line2_line3:
-            return "L2-L3: \n" + str(self.line2_line3)
-        elif self.meas_line3_line1:
-            return "L3-L1: \n" + str(self.line3_line1)
-        else:
-            return "No measurements specified."
-            
-    # methods
-    def update_measurements(self):
-        """Update all the measurements."""
+            self.line3_line1 = LToLPQube(client=self,
+                                         v_rms_register_id=self.REG_V_L3_L1)
+        # read all active L-L voltages together
         if self.meas_line1_line2:
-            self.line1_line2.update_line_measurements()
+            self._add_line("L1-L2", self.line1_line2)
         if self.meas_line2_line3:
-            self.line2_line3.update_line_measurements()
+            self._add_line("L2-L3", self.line2_line3)
         if self.meas_line3_line1:
-            self.line3_line1.update_line_measurements()
-            
-    def pqube_phase_log(self):
-        """Returns updated measurements as a list for data logging."""
-        self.update_measurements()
-        if self.meas_line1_line2 and self.meas_line2_line3 and self.meas_line3_line1:
-            values = [self.line1_line2.v_rms, self.line2_line3.v_rms,
-                      self.line3_line1.v_rms]
-        elif self.meas_line1_line2 and self.meas_line2_line3:
-            values = [self.line1_line2.v_rms, self.line2_line3.v_rms, ""]
-        elif self.meas_line2_line3 and self.meas_line3_line1:
-            values = ["", self.line2_line3.v_rms,self.line3_line1.v_rms]
-        elif self.meas_line1_line2 and self.meas_line3_line1:
-            values = [self.line1_line2.v_rms, "", self.line3_line1.v_rms]
-        elif self.meas_line1_line2:
-            values = [self.line1_line2.v_rms]
-            values.extend(list([""]*2))
-        elif self.meas_line2_line3:
-            values = ["", self.line2_line3.v_rms, ""]
-        elif self.meas_line3_line1:
-            values = list([""]*2)
-            values.extend([self.line3_line1.v_rms])
-        else:
-            values = list([""]*3)
-            
-        return values
+            self._add_line("L3-L1", self.line3_line1)
+        self._plan_reads()
+        # data log layout: L1-L2, L2-L3, L3-L1 voltages, blank if inactive
+        self._log_layout(3)
+        for i, active, name in ((0, self.meas_line1_line2, "line1_line2"),
+                                (1, self.meas_line2_line3, "line2_line3"),
+                                (2, self.meas_line3_line1, "line3_line1")):
+            if active:
+                self._log_slot(i, getattr(self, name), ("v_rms",))
     
     
-class PQube1pLL(ModbusClient):
+class PQube1pLL(PQubeBase):
     """Class for data collection with PQube in Single_Phase_L1_L2 configuration.
     
     Attributes:
@@ -508,6 +1082,7 @@ class PQube1pLL(ModbusClient):
         |  debug: (bool) debug state, default False
         |  meas_line1_line2: (bool) collect L1-L2 measurements. Default False
         |  line1_line2: object containing L1-L2 measurements.
+        |  **kwargs: connection and polling options, see PQubeBase.
         
         L-L measurement attributes: v_rms
         
@@ -518,53 +1093,28 @@ class PQube1pLL(ModbusClient):
     """
     
     # register addresses
-    REG_POWER_CONFIG = 8022
+    POWER_CONFIG = 1
+    POWER_CONFIG_NAME = "single_phase_l1_l2"
     REG_V_L1_L2 = 7014
     
     # constructors
     def __init__(self, hostname="10.60.36.6" , port=502 ,auto_open=True, 
-                 debug=False, meas_line1_line2=False):
-        """Inits PQube3pDelta."""
-        ModbusClient.__init__(self, host=hostname, port=port, 
-                              auto_open=auto_open, debug=debug)
+                 debug=False, meas_line1_line2=False, **kwargs):
+        """Inits PQube1pLL."""
+        PQubeBase.__init__(self, hostname, port, auto_open, debug, **kwargs)
         self.meas_line1_line2 = meas_line1_line2
-        # check power config on pqube
-        if self.read_input_registers(self.REG_POWER_CONFIG)[0] != 1:
-            print("Make sure the power configuration in the 'Setup.ini' file" +
-                  " matches the 'power_config' attribute in device initialization.")
-            raise AttributeError
-        if self.meas_line1_line2:
-            self.line1_line2 = LToLPQube(hostname=hostname, port=port,
-                                                auto_open=auto_open,
-                                                debug=debug,
-                                                v_rms_register_id=self.REG_V_L1_L2)
-        if auto_open:
-            self.open()
-            
-    def __str__(self):
-        if self.meas_line1_line2:
-            return "L1-L2: \n" + str(self.line1_line2)
-        else:
-            return "No measurements specified."
-        
-    # methods
-    def update_measurements(self):
-        """Update all the measurements."""
         if self.meas_line1_line2:
-            self.line1_line2.update_line_measurements()
-            
-    def pqube_phase_log(self):
-        """Returns updated measurements as a list for data logging."""
-        self.update_measurements()
+            self.line1_line2 = LToLPQube(client=self,
+                                         v_rms_register_id=self.REG_V_L1_L2)
+            self._add_line("L1-L2", self.line1_line2)
+        self._plan_reads()
+        # data log layout: L1-L2 voltage, blank if inactive
+        self._log_layout(1)
         if self.meas_line1_line2:
-            values = [self.line1_line2.v_rms]
-        else:
-            values = list([""])
-            
-        return values
+            self._log_slot(0, self.line1_line2, ("v_rms",))
 
     
-class PQube3pWye(ModbusClient):
+class PQube3pWye(PQubeBase):
     """Class for data collection with PQube in 3 phase Wye/Star configuration.
     
     Added on: 10/02/2018
@@ -580,7 +1130,7 @@ class PQube3pWye(ModbusClient):
         |  line1: object containing L1 measurements.
         |  line2: object containing L2 measurements.
         |  line3: object containing L3 measurements.
-        
+        |  **kwargs: connection and polling options, see PQubeBase.
         
     Methods: 
         |  update_measurements: update all the specified measurements.
@@ -589,7 +1139,9 @@ class PQube3pWye(ModbusClient):
     """
     
     # register addresses
-    REG_POWER_CONFIG = 8022
+    POWER_CONFIG = 3    # star/wye
+    POWER_CONFIG_NAME = "3p_wye"
+    NO_LINES_MESSAGE = "No Line measurements specified."
     REG_FREQ = 7026
     REG_V_RMS = [7008, 7010, 7012]
     REG_V_MAG_FUNDAMENTAL = [7098, 7102, 7106]
@@ -602,153 +1154,59 @@ class PQube3pWye(ModbusClient):
     REG_WATT = [7204, 7206, 7208]
     REG_VA = [7210, 7212, 7214]
     REG_VAR_FUNDAMENTAL = [7216, 7218, 7220]
-    READ_2_REG = 2    # read two registers
     
     # constructors
     def __init__(self, hostname="10.60.36.6" , port=502 ,auto_open=True, 
                  debug=False, meas_line1=False, 
-                 meas_line2=False, meas_line3=False):
-        """Inits PQube3pDelta."""
-        ModbusClient.__init__(self, host=hostname, port=port, 
-                              auto_open=auto_open, debug=debug)
+                 meas_line2=False, meas_line3=False, **kwargs):
+        """Inits PQube3pWye."""
+        PQubeBase.__init__(self, hostname, port, auto_open, debug, **kwargs)
         self.meas_line1 = meas_line1
         self.meas_line2 = meas_line2
         self.meas_line3 = meas_line3
-        
-        # check power config on pqube: star/wye is 3
-        if self.read_input_registers(self.REG_POWER_CONFIG)[0] != 3:
-            print("Make sure the power configuration in the 'Setup.ini' file" +
-                  " matches the 'power_config = 3p_wye' attribute " + 
-                  "in device initialization.")
-            raise AttributeError
-            
-        # define line-to-neutral measurement objects    
-        if self.meas_line1:
-            self.line1 = LinePQube(
-                    hostname=hostname, port=port,
-                    auto_open=auto_open, debug=debug,
-                    v_rms_register_id=self.REG_V_RMS[0],
-                    v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL[0],
-                    v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL[0],
-                    i_rms_register_id=self.REG_I_RMS[0],
-                    i_mag_fundamental_register_id = self.REG_I_MAG_FUNDAMENTAL[0],
-                    i_angle_fundamental_register_id = self.REG_I_ANGLE_FUNDAMENTAL[0],
-                    s_register_id=self.REG_VA[0],
-                    p_register_id=self.REG_WATT[0],
-                    q_register_id=self.REG_VAR_FUNDAMENTAL[0],
-                    v_thd_register_id=self.REG_V_THD[0],
-                    i_tdd_register_id=self.REG_I_TDD[0])
-        if self.meas_line2:
-            self.line2 = LinePQube(
-                    hostname=hostname, port=port,
-                    auto_open=auto_open, debug=debug,
-                    v_rms_register_id=self.REG_V_RMS[1],
-                    v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL[1],
-                    v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL[1],
-                    i_rms_register_id=self.REG_I_RMS[1],
-                    i_mag_fundamental_register_id = self.REG_I_MAG_FUNDAMENTAL[1],
-                    i_angle_fundamental_register_id = self.REG_I_ANGLE_FUNDAMENTAL[1],
-                    s_register_id=self.REG_VA[1],
-                    p_register_id=self.REG_WATT[1],
-                    q_register_id=self.REG_VAR_FUNDAMENTAL[1],
-                    v_thd_register_id=self.REG_V_THD[1],
-                    i_tdd_register_id=self.REG_I_TDD[1])
-        if self.meas_line3:
-            self.line3 = LinePQube(
-                    hostname=hostname, port=port,
-                    auto_open=auto_open, debug=debug,
-                    v_rms_register_id=self.REG_V_RMS[2],
-                    v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL[2],
-                    v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL[2],
-                    i_rms_register_id=self.REG_I_RMS[2],
-                    i_mag_fundamental_register_id = self.REG_I_MAG_FUNDAMENTAL[2],
-                    i_angle_fundamental_register_id = self.REG_I_ANGLE_FUNDAMENTAL[2],
-                    s_register_id=self.REG_VA[2],
-                    p_register_id=self.REG_WATT[0],
-                    q_register_id=self.REG_VAR_FUNDAMENTAL[2],
-                    v_thd_register_id=self.REG_V_THD[2],
-                    i_tdd_register_id=self.REG_I_TDD[2])
-        if auto_open:
-            self.open()
-            
-    def __str__(self):
-        if self.meas_line1 and self.meas_line2 and self.meas_line3:
-            return ("Line 1: \n" + str(self.line1) + 
-                    "\nLine 2: \n" + str(self.line2) + 
-                    "\nLine 3: \n" + str(self.line3))
-        elif self.meas_line1:
-            return "Line 1: \n" + str(self.line1)
-        elif self.meas_line2:
-            return "Line 2: \n" + str(self.line2)
-        elif self.meas_line3:
-            return "Line 2: \n" + str(self.line3)
-        else:
-            return "No Line measurements specified."
-            
-    # methods
-    def meas_freq(self):
-        """Returns the measured frequency."""
-        return convert_to_long(
-                self.read_input_registers(self.REG_FREQ, self.READ_2_REG))
-    
-    def update_measurements(self):
-        """Update all the measurements."""
-        self.freq = self.meas_freq()
-        if self.meas_line1:
-            self.line1.update_line_measurements()
-        if self.meas_line2:
-            self.line2.update_line_measurements()
-        if self.meas_line3:
-            self.line3.update_line_measurements()
-            
-    def pqube_phase_log(self):
-        """Returns updated measurements as a list for data logging."""
-        self.update_measurements()
-        values = [self.freq]
-        if  self.meas_line1:
-            values.extend([self.line1.v_rms,
-                           self.line1.v_mag_fundamental,
-                           self.line1.v_angle_funamental,
-                           self.line1.i_rms,
-                           self.line1.i_mag_funamental,
-                           self.line1.i_angle_fundamental,
-                           self.line1.apparent_power, self.line1.real_power, 
-                           self.line1.reactive_power, 
-                           self.line1.v_thd, self.line1.i_tdd])
-        else:
-            values.extend([""]*11)
             
-        if self.meas_line2:
-            values.extend([self.line2.v_rms,
-                           self.line2.v_mag_fundamental,
-                           self.line2.v_angle_funamental,
-                           self.line2.i_rms, 
-                           self.line2.i_mag_funamental,
-                           self.line2.i_angle_fundamental,
-                           self.line2.apparent_power, self.line2.real_power, 
-                           self.line2.reactive_power, self.line2.v_thd, 
-                           self.line2.i_tdd])
-        else: values.extend([""]*11)
+        # define line-to-neutral measurement objects, line1..line3
+        for i, active in enumerate((meas_line1, meas_line2, meas_line3)):
+            if not active:
+                continue
+            line = LinePQube(
+                    client=self,
+                    v_rms_register_id=self.REG_V_RMS[i],
+                    v_mag_fundamental_register_id = self.REG_V_MAG_FUNDAMENTAL[i],
+                    v_angle_fundamental_register_id = self.REG_V_ANGLE_FUNDAMENTAL[i],
+                    i_rms_register_id=self.REG_I_RMS[i],
+                    i_mag_fundamental_register_id = self.REG_I_MAG_FUNDAMENTAL[i],
+                    i_angle_fundamental_register_id = self.REG_I_ANGLE_FUNDAMENTAL[i],
+                    s_register_id=self.REG_VA[i],
+                    p_register_id=self.REG_WATT[i],
+                    q_register_id=self.REG_VAR_FUNDAMENTAL[i],
+                    v_thd_register_id=self.REG_V_THD[i],
+                    i_tdd_register_id=self.REG_I_TDD[i])
+            setattr(self, "line%d" % (i + 1), line)
+            self._add_line("Line %d" % (i + 1), line)
+        self._plan_reads()
         
-        if self.meas_line3:
-            values.extend([self.line3.v_rms,
-                           self.line3.v_mag_fundamental,
-                           self.line3.v_angle_funamental,
-                           self.line3.i_rms, 
-                           self.line3.i_mag_funamental,
-                           self.line3.i_angle_fundamental,
-                           self.line3.apparent_power, self.line2.real_power, 
-                           self.line3.reactive_power, self.line2.v_thd, 
-                           self.line3.i_tdd])
-        else: values.extend([""]*11)
-                
-        if not(self.meas_line1) and not(self.meas_line2) and not(self.meas_line3):
-            values = list([""]*34)
-        
-        return values
-    
-    
-    
+        # data log layout: freq, then 11 slots per line, blank if inactive
+        n_attrs = len(LinePQube.MEAS_ATTRS)
+        self._log_layout(1 + 3 * n_attrs)
+        if self._lines:
+            self._log_slot(0, self, ("freq",))
+        for i, active in enumerate((meas_line1, meas_line2, meas_line3)):
+            if active:
+                line = getattr(self, "line%d" % (i + 1))
+                self._log_slot(1 + i * n_attrs, line, LinePQube.MEAS_ATTRS)
+
+
+# power_config of PQube: (configuration class, its meas_* arguments)
+_CONFIG_MAP = {
+    "split_single_phase": (PQubeSplit1p, ("meas_line1", "meas_line2")),
+    "3p_delta": (PQube3pDelta, ("meas_line1_line2", "meas_line2_line3", 
+                                "meas_line3_line1")),
+    "3p_wye": (PQube3pWye, ("meas_line1", "meas_line2", "meas_line3")),
+    "single_phase_l1_l2": (PQube1pLL, ("meas_line1_line2",)),
+}
+
+
 class PQube(ModbusClient):
     """PQube class to communicate with the pQube device via TCP/IP.
     
@@ -771,64 +1229,47 @@ class PQube(ModbusClient):
            Measures L2-L3 attributes. Default False
         |  meas_line3_line1: Valid only when power_config="3p_delta" is set.
            Measures L3-L1 attributes. Default False
+        |  **kwargs: connection and polling options of the configuration
+           class, e.g. min_poll_interval=0.2 for the device update rate, 
+           see PQubeBase.
         |  measurements: Object holds the specified measurements.
         
     Methods:
         |  pqube_log: updates all the collected data and returns as a list.    
+        |  async_pqube_log: coroutine version of pqube_log.
+        |  pqube_log_array: same as pqube_log, returned as an array('f') 
+           with NaN for the measurements not collected.
+        |  pqube_log_csv: same as pqube_log, returned as a CSV line.
     """
     
     def __init__(self, hostname="10.60.36.5", port=502, auto_open=True, 
                  debug=False, power_config="split_single_phase",
                  meas_line1=False, meas_line2=False, meas_line3=False,
                  meas_line1_line2=False, meas_line2_line3=False,
-                 meas_line3_line1=False):
+                 meas_line3_line1=False, **kwargs):
         ModbusClient.__init__(self, host=hostname, port=port, 
                               auto_open=auto_open, debug=debug)
         self.power_config = power_config
         "TODO: Expand power_config check for all possible PQube configurations"
         "PQube returns a list, i.e., [0]"
-        if self.power_config=="split_single_phase":
-            if meas_line1_line2 or meas_line2_line3 or meas_line3_line1 or meas_line3:
-                raise ValueError("meas_line1_line2, meas_line2_line3, " +
-                                 "meas_line3_line1 cannot be set to True " + 
-                                 "for split_single_phase power configuration.")
-            self.measurements = PQubeSplit1p(hostname=hostname, port=port,
-                                             auto_open=auto_open, debug=debug,
-                                             meas_line1=meas_line1, 
-                                             meas_line2=meas_line2)
-        elif self.power_config=="3p_delta":
-            if meas_line1 or meas_line2 or meas_line3:
-                raise ValueError("meas_line1, meas_line2, meas_line3 " + 
-                                 "cannot be set to " + 
-                                 "True for 3p_delta power configuration.")
-            self.measurements = PQube3pDelta(hostname=hostname, port=port, 
-                                             auto_open=auto_open, debug=debug,
-                                             meas_line1_line2=meas_line1_line2,
-                                             meas_line2_line3=meas_line2_line3,
-                                             meas_line3_line1=meas_line3_line1)
-            
-        elif self.power_config=="3p_wye":
-            if meas_line1_line2 or meas_line2_line3 or meas_line3_line1:
-                raise ValueError("meas_line1_line2, meas_line2_line3, " +
-                                 "meas_line3_line1 cannot be set to True " + 
-                                 "for 3p_wye power configuration.")
-            self.measurements = PQube3pWye(hostname=hostname, port=port,
-                                             auto_open=auto_open, debug=debug,
-                                             meas_line1=meas_line1, 
-                                             meas_line2=meas_line2, 
-                                             meas_line3=meas_line3)
-            
-        elif self.power_config=="single_phase_l1_l2":
-            if meas_line1 or meas_line2 or meas_line3 or meas_line2_line3 or meas_line3_line1:
-                raise ValueError("meas_line1, meas_line2, meas_line3, " +
-                                 "meas_line2_line3, meas_line3_line1 " +
-                                 "cannont be set to True for " +
-                                 "single_phase_L1_L2 power configuration")
-            self.measurements = PQube1pLL(hostname=hostname, port = port, 
-                                          auto_open=auto_open, debug=debug, 
-                                          meas_line1_line2=meas_line1_line2)
-        else:
+        if self.power_config not in _CONFIG_MAP:
             raise ValueError("Unknown power configuration.")
+        config_class, config_lines = _CONFIG_MAP[self.power_config]
+        meas_lines = {"meas_line1": meas_line1, "meas_line2": meas_line2,
+                      "meas_line3": meas_line3, 
+                      "meas_line1_line2": meas_line1_line2,
+                      "meas_line2_line3": meas_line2_line3, 
+                      "meas_line3_line1": meas_line3_line1}
+        invalid = [name for name, value in meas_lines.items() 
+                   if value and name not in config_lines]
+        if invalid:
+            raise ValueError(", ".join(invalid) + " cannot be set to True " +
+                             "for " + self.power_config + 
+                             " power configuration.")
+        self.measurements = config_class(
+                hostname=hostname, port=port, auto_open=auto_open, 
+                debug=debug, 
+                **{name: meas_lines[name] for name in config_lines}, **kwargs)
             
     def __str__(self):
         return str(self.measurements)
@@ -836,4 +1277,19 @@ class PQube(ModbusClient):
     def pqube_log(self):
         return self.measurements.pqube_phase_log() 
     
+    async def async_pqube_log(self):
+        """Coroutine version of pqube_log, over an asyncio connection."""
+        return await self.measurements.async_pqube_phase_log()
+    
+    def pqube_log_array(self):
+        """Returns the updated measurements as a compact float32 array, NaN
+        marking the measurements not collected."""
+        return array("f", [float('nan') if value == "" else value 
+                           for value in self.pqube_log()])
+    
+    def pqube_log_csv(self):
+        """Returns the updated measurements as one CSV line, blank for the
+        measurements not collected, e.g. to write straight to a file."""
+        return self.measurements.pqube_phase_log_csv()
+    
     
\ No newline at end of file
@@ -0,0 +1,529 @@
+"""Tests of the register read planning and of the pipelined Modbus/TCP
+client, against a loopback fake device.
+
+Run with: python -m unittest test_pqube
+"""
+
+import asyncio
+import math
+import socket
+import struct
+import threading
+import unittest
+
+from pqube import (_CONFIG_MAP, LinePQube, ModbusExceptionError,
+                   PipelinedModbusClient, PQube, PQube3pWye,
+                   async_update_measurements, decode_floats,
+                   plan_register_reads)
+
+
+def float32(value):
+    """Returns value rounded to single precision."""
+    return struct.unpack(">f", struct.pack(">f", value))[0]
+
+
+class FakeDevice(threading.Thread):
+    """Loopback Modbus/TCP server answering read input registers requests
+    with register value = register address.
+
+    Attributes:
+        |  batch: requests collected before answering them together.
+        |  reply: function building the answer bytes of a list of
+           (transaction_id, unit_id, reg_addr, reg_nb) requests.
+        |  close_after_reply: close the connection after each answer.
+        |  in_flight: number of requests received at each answer.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self._sock = socket.socket()
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self.batch = 1
+        self.reply = self.in_order
+        self.close_after_reply = False
+        self.in_flight = []
+        self._serving = []    # (connection, thread) of each client
+
+    def registers(self, reg_addr, reg_nb):
+        """Returns the register values of a read."""
+        return range(reg_addr, reg_addr + reg_nb)
+
+    def response(self, tr_id, unit_id, reg_addr, reg_nb, protocol_id=0):
+        """Returns the response frame of a request."""
+        body = (struct.pack(">BB", 4, 2 * reg_nb) +
+                struct.pack(">%dH" % reg_nb,
+                            *self.registers(reg_addr, reg_nb)))
+        return struct.pack(">HHHB", tr_id, protocol_id, len(body) + 1,
+                           unit_id) + body
+
+    @staticmethod
+    def exception(tr_id, unit_id, exception_code):
+        """Returns an exception response frame."""
+        return struct.pack(">HHHBBB", tr_id, 0, 3, unit_id, 4 | 0x80,
+                           exception_code)
+
+    def in_order(self, requests):
+        return b"".join(self.response(*request) for request in requests)
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            serving = threading.Thread(target=self._serve, args=(conn,),
+                                       daemon=True)
+            self._serving.append((conn, serving))
+            serving.start()
+
+    def _serve(self, conn):
+        with conn:
+            self._answer(conn)
+
+    def _answer(self, conn):
+        buf = b""
+        requests = []
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while len(buf) >= 12:
+                tr_id, _, _, unit_id, _, reg_addr, reg_nb = struct.unpack(
+                        ">HHHBBHH", buf[:12])
+                requests.append((tr_id, unit_id, reg_addr, reg_nb))
+                buf = buf[12:]
+            if len(requests) >= self.batch:
+                self.in_flight.append(len(requests))
+                conn.sendall(self.reply(requests))
+                requests = []
+                if self.close_after_reply:
+                    return
+
+    def stop(self):
+        # close() alone does not wake up a thread blocked in accept/recv
+        for sock in [self._sock] + [conn for conn, _ in self._serving]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._sock.close()
+        self.join()
+        for _, serving in self._serving:
+            serving.join()
+
+
+class FakePQube(FakeDevice):
+    """FakeDevice answering as a PQube: register 8022 holds power_config
+    and each float register reg holds values[reg], reg + 0.5 by default.
+    reads lists the (reg_addr, reg_nb) of each read answered.
+    """
+
+    REG_POWER_CONFIG = 8022
+
+    def __init__(self):
+        FakeDevice.__init__(self)
+        self.power_config = 0
+        self.values = {}
+        self.reads = []
+
+    def value(self, reg):
+        """Returns the float held by register reg."""
+        return self.values.get(reg, reg + 0.5)
+
+    def registers(self, reg_addr, reg_nb):
+        self.reads.append((reg_addr, reg_nb))
+        words = []
+        for reg in range(reg_addr, reg_addr + reg_nb):
+            if reg == self.REG_POWER_CONFIG:
+                words.append(self.power_config)
+                continue
+            high, low = struct.unpack(">HH", struct.pack(">f",
+                                                         self.value(reg & ~1)))
+            words.append(low if reg & 1 else high)
+        return words
+
+    def requests(self):
+        """Returns the number of read requests answered."""
+        return sum(self.in_flight)
+
+
+class PlanRegisterReadsTest(unittest.TestCase):
+
+    def test_contiguous_registers_share_a_block(self):
+        self.assertEqual(plan_register_reads([7012, 7008, 7010, 7008]),
+                         [(7008, 6, [7008, 7010, 7012])])
+
+    def test_gap_is_merged_up_to_max_gap(self):
+        self.assertEqual(plan_register_reads([7008, 7014]),
+                         [(7008, 2, [7008]), (7014, 2, [7014])])
+        self.assertEqual(plan_register_reads([7008, 7014], max_gap=4),
+                         [(7008, 8, [7008, 7014])])
+
+    def test_block_is_capped_at_max_regs(self):
+        self.assertEqual(plan_register_reads([7008, 7010, 7012], max_regs=4),
+                         [(7008, 4, [7008, 7010]), (7012, 2, [7012])])
+        plan = plan_register_reads(range(7000, 7400, 2), max_gap=125)
+        self.assertEqual([count for _, count, _ in plan], [124, 124, 124, 28])
+
+    def test_odd_offset_starts_a_new_block(self):
+        self.assertEqual(plan_register_reads([7008, 7011], max_gap=10),
+                         [(7008, 2, [7008]), (7011, 2, [7011])])
+
+    def test_invalid_max_regs(self):
+        for max_regs in (1, 126):
+            with self.assertRaises(ValueError):
+                plan_register_reads([7008], max_regs=max_regs)
+
+    def test_decode_floats_bytes_and_registers(self):
+        data = struct.pack(">ff", 1.5, -2.0)
+        words = list(struct.unpack(">4H", data))
+        self.assertEqual(decode_floats(data), (1.5, -2.0))
+        self.assertEqual(decode_floats(words), (1.5, -2.0))
+
+
+class PipelinedModbusClientTest(unittest.TestCase):
+
+    BLOCKS = [(7008, 6), (7026, 8), (7192, 30)]
+
+    def setUp(self):
+        self.device = FakeDevice()
+        self.device.start()
+        self.client = PipelinedModbusClient(host="127.0.0.1",
+                                            port=self.device.port,
+                                            auto_open=True, timeout=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.device.stop()
+
+    def expected(self, blocks):
+        return [list(range(start, start + count)) for start, count in blocks]
+
+    def test_blocks_are_read_in_one_round_trip(self):
+        # the device only answers once it got every request
+        self.device.batch = len(self.BLOCKS)
+        self.assertEqual(self.client.pipeline_read(self.BLOCKS),
+                         self.expected(self.BLOCKS))
+        self.assertEqual(self.device.in_flight, [3])
+
+    def test_responses_matched_by_transaction_id(self):
+        def out_of_order(requests):
+            stray = self.device.response(0xbeef, 1, 1, 1)
+            return stray + b"".join(self.device.response(*request)
+                                    for request in reversed(requests))
+        self.device.batch = len(self.BLOCKS)
+        self.device.reply = out_of_order
+        self.assertEqual(self.client.read_blocks(self.BLOCKS),
+                         self.expected(self.BLOCKS))
+        self.assertTrue(self.client.is_open())
+
+    def test_responses_of_another_protocol_or_unit_ignored(self):
+        def foreign_first(requests):
+            tr_id, unit_id, reg_addr, reg_nb = requests[0]
+            return (self.device.response(tr_id, unit_id, reg_addr + 1,
+                                         reg_nb, protocol_id=1) +
+                    self.device.response(tr_id, unit_id + 1, reg_addr + 2,
+                                         reg_nb) +
+                    self.device.response(*requests[0]))
+        self.device.reply = foreign_first
+        self.assertEqual(self.client.read_blocks(self.BLOCKS[:1]),
+                         self.expected(self.BLOCKS[:1]))
+
+    def test_exception_response(self):
+        def refuse_second(requests):
+            tr_id, unit_id, _, _ = requests[1]
+            return (self.device.response(*requests[0]) +
+                    FakeDevice.exception(tr_id, unit_id, 2))
+        self.device.batch = 2
+        self.device.reply = refuse_second
+        blocks = self.BLOCKS[:2]
+        self.assertEqual(self.client.pipeline_read(blocks),
+                         [self.expected(blocks)[0], None])
+        with self.assertRaises(ModbusExceptionError) as caught:
+            self.client.read_blocks(blocks)
+        self.assertEqual(caught.exception.exception_code, 2)
+        self.assertEqual(caught.exception.reg_addr, 7026)
+        # the connection is fine, nothing was retried
+        self.assertTrue(self.client.is_open())
+        self.assertEqual(self.device.in_flight, [2, 2])
+
+    def test_short_read(self):
+        def truncated(requests):
+            return self.device.response(*requests[0])[:-3]
+        self.device.reply = truncated
+        self.device.close_after_reply = True
+        self.assertEqual(self.client.pipeline_read(self.BLOCKS[:1]), [None])
+        self.assertFalse(self.client.is_open())
+        with self.assertRaises(ConnectionError):
+            self.client.read_blocks(self.BLOCKS[:1])
+
+    def test_strict_compliance_sends_one_request_at_a_time(self):
+        self.client.strict_compliance = True
+        self.assertEqual(self.client.read_blocks(self.BLOCKS),
+                         self.expected(self.BLOCKS))
+        self.assertEqual(self.device.in_flight, [1, 1, 1])
+
+    def test_async_read_blocks(self):
+        self.device.batch = len(self.BLOCKS)
+
+        async def read():
+            try:
+                return await self.client.async_read_blocks(self.BLOCKS)
+            finally:
+                self.client.async_close()
+
+        self.assertEqual(asyncio.run(read()), self.expected(self.BLOCKS))
+
+    def test_reconnect_backs_off(self):
+        self.device.stop()
+        self.client.port(self.device.port)
+        self.assertEqual(self.client.pipeline_read(self.BLOCKS[:1]), [None])
+        self.assertFalse(self.client._connect_allowed())
+
+
+
+class PQubeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakePQube()
+        self.device.start()
+
+    def tearDown(self):
+        self.device.stop()
+
+    def pqube(self, power_config, **kwargs):
+        """Returns a PQube connected to the fake device, set up in 
+        power_config."""
+        self.device.power_config = _CONFIG_MAP[power_config][0].POWER_CONFIG
+        p = PQube(hostname="127.0.0.1", port=self.device.port,
+                  power_config=power_config, **kwargs)
+        self.addCleanup(p.measurements.close)
+        return p
+
+    def test_power_config_checked(self):
+        p = self.pqube("3p_wye", meas_line1=True)
+        self.assertEqual(p.measurements._power_config, 3)
+        self.device.power_config = 2
+        with self.assertRaises(AttributeError):
+            PQube(hostname="127.0.0.1", port=self.device.port,
+                  power_config="3p_wye", meas_line1=True)
+
+    def test_line_register_ids_read_only(self):
+        line = self.pqube("3p_wye", meas_line1=True).measurements.line1
+        self.assertEqual(line.v_rms_register_id, 7008)
+        with self.assertRaises(AttributeError):
+            line.v_rms_register_id = 7012
+        self.assertEqual(line.v_rms_register_id, 7008)
+
+    def test_line_measurement_set_by_hand(self):
+        line = self.pqube("3p_wye", meas_line1=True).measurements.line1
+        line.i_rms = 1.1
+        self.assertEqual(line.i_rms, 1.1)
+
+    def test_log_csv(self):
+        self.device.values[7010] = 1 / 3    # line2 v_rms
+        p = self.pqube("split_single_phase", meas_line2=True)
+        line = p.pqube_log_csv()
+        self.assertTrue(line.endswith("\n"))
+        cells = line[:-1].split(",")
+        log = p.pqube_log()
+        self.assertEqual(len(cells), len(log))
+        self.assertEqual(float32(float(cells[12])), float32(1 / 3))
+        for cell, value in zip(cells, log):
+            if value == "":
+                self.assertEqual(cell, "")
+            else:    # no precision lost
+                self.assertEqual(float32(float(cell)), value)
+
+    def test_meas_freq(self):
+        with self.assertRaises(AttributeError):
+            self.pqube("3p_delta").measurements.meas_freq()
+        p = self.pqube("split_single_phase", meas_line1=True).measurements
+        self.assertEqual(p.meas_freq(), 7026.5)
+        p.update_measurements()
+        self.assertEqual(p.freq, 7026.5)
+        self.device.stop()
+        with self.assertRaisesRegex(ConnectionError, "127.0.0.1"):
+            p.meas_freq()
+
+    def test_str_lists_each_active_line(self):
+        p = self.pqube("3p_wye", meas_line1=True, meas_line3=True)
+        p.pqube_log()
+        text = str(p)
+        self.assertIn("Line 1: \nV_RMS: 7008.5 V", text)
+        self.assertIn("Line 3: \nV_RMS: 7012.5 V", text)
+        self.assertNotIn("Line 2", text)
+        self.assertEqual(str(self.pqube("3p_wye")),
+                         "No Line measurements specified.")
+
+    def test_line_to_line_str(self):
+        p = self.pqube("3p_delta", meas_line1_line2=True,
+                       meas_line3_line1=True)
+        p.pqube_log()
+        self.assertEqual(str(p), "L1-L2: \nV_RMS: 7014.5 V\n"
+                                 "L3-L1: \nV_RMS: 7018.5 V")
+
+    def test_options_passed_through(self):
+        p = self.pqube("3p_wye", meas_line1=True, min_poll_interval=5,
+                       strict_compliance=True, keepalive_idle=7)
+        self.assertEqual(p.measurements.min_poll_interval, 5)
+        self.assertTrue(p.measurements.strict_compliance)
+        self.assertEqual(p.measurements.keepalive_idle, 7)
+        with self.assertRaises(TypeError):
+            self.pqube("3p_wye", meas_line1=True, poll_interval=5)
+
+    def test_unreachable_device(self):
+        self.device.stop()
+        with self.assertRaisesRegex(ConnectionError, "127.0.0.1"):
+            PQube(hostname="127.0.0.1", port=self.device.port,
+                  meas_line1=True)
+
+    def test_one_connection_per_device(self):
+        p = self.pqube("3p_wye", meas_line1=True, meas_line2=True)
+        p.pqube_log()
+        p.measurements.line1.update_line_measurements()
+        self.assertEqual(len(self.device._serving), 1)
+
+    def test_power_config_read_once(self):
+        p = self.pqube("3p_wye", meas_line1=True)
+        p.pqube_log()
+        p.pqube_log()
+        config_reads = [(start, count) for start, count in self.device.reads
+                        if start <= FakePQube.REG_POWER_CONFIG < start + count]
+        self.assertEqual(config_reads, [(FakePQube.REG_POWER_CONFIG, 1)])
+
+    def test_log_layout(self):
+        n_attrs = len(LinePQube.MEAS_ATTRS)
+        log = self.pqube("split_single_phase", meas_line2=True).pqube_log()
+        self.assertEqual(len(log), 1 + 2 * n_attrs)
+        self.assertEqual(log[0], 7026.5)    # freq
+        self.assertEqual(log[1:1 + n_attrs], [""] * n_attrs)
+        self.assertEqual(log[1 + n_attrs], 7010.5)    # line2 v_rms
+        log = self.pqube("3p_wye", meas_line3=True).pqube_log()
+        real_power = LinePQube.MEAS_ATTRS.index("real_power")
+        self.assertEqual(log[1 + 2 * n_attrs + real_power], 7208.5)
+
+    def test_lines_have_no_instance_dict(self):
+        lines = (self.pqube("3p_wye", meas_line1=True).measurements.line1,
+                 self.pqube("3p_delta", 
+                            meas_line1_line2=True).measurements.line1_line2)
+        for line in lines:
+            with self.assertRaises(AttributeError):
+                line.v_rsm = 1.0
+
+    def test_max_words_per_request(self):
+        m = self.pqube("3p_wye", meas_line1=True, meas_line2=True,
+                       meas_line3=True, max_words_per_request=20).measurements
+        del self.device.reads[:]
+        m.update_measurements()
+        self.assertTrue(all(count <= 20 for _, count in self.device.reads))
+        self.assertEqual(m.line3.real_power, 7208.5)
+        for max_words in (1, 126):
+            with self.assertRaises(ValueError):
+                self.pqube("3p_wye", max_words_per_request=max_words)
+
+    def test_log_array(self):
+        p = self.pqube("split_single_phase", meas_line2=True)
+        log = p.pqube_log_array()
+        self.assertEqual(log.typecode, "f")
+        self.assertEqual(log[0], 7026.5)
+        self.assertTrue(all(math.isnan(value) for value in log[1:12]))
+        self.assertEqual(list(log[12:]), p.pqube_log()[12:])
+
+    def test_lines_read_in_one_round_trip(self):
+        m = self.pqube("3p_wye", meas_line1=True, meas_line2=True,
+                       meas_line3=True).measurements
+        self.assertLessEqual(len(m._blocks), 2)
+        # the device only answers once it got every request
+        self.device.batch = len(m._blocks)
+        answers = len(self.device.in_flight)
+        m.update_measurements()
+        self.assertEqual(self.device.in_flight[answers:], [len(m._blocks)])
+        self.assertEqual(m.freq, 7026.5)
+        self.assertEqual(m.line3.real_power, 7208.5)
+
+    def test_min_poll_interval(self):
+        m = self.pqube("3p_wye", meas_line3=True,
+                       min_poll_interval=60).measurements
+        line3_v_rms = 1 + 2 * len(LinePQube.MEAS_ATTRS)
+        self.assertEqual(m.pqube_phase_log()[line3_v_rms], 7012.5)
+        requests = self.device.requests()
+        self.device.values[7012] = 1.5
+        self.assertEqual(m.pqube_phase_log()[line3_v_rms], 7012.5)
+        self.assertEqual(self.device.requests(), requests)
+        m.force_refresh()
+        self.assertEqual(m.pqube_phase_log()[line3_v_rms], 1.5)
+
+    def test_measurements_decoded_when_accessed(self):
+        m = self.pqube("3p_wye", meas_line1=True).measurements
+        line = m.line1
+        m.update_measurements()
+        self.assertNotEqual(line._tick, m._tick)
+        self.assertEqual(line.v_rms, 7008.5)
+        self.assertEqual(line._tick, m._tick)
+        self.device.values[7008] = 2.5
+        m.update_measurements()
+        self.assertEqual(line.v_rms, 2.5)
+        # read on its own, newer than the device blocks
+        self.device.values[7008] = 3.5
+        line.update_line_measurements()
+        self.assertEqual(line.v_rms, 3.5)
+
+    def test_power_config_dispatch(self):
+        for power_config, (config_class, _) in _CONFIG_MAP.items():
+            self.assertIsInstance(self.pqube(power_config).measurements,
+                                  config_class)
+        with self.assertRaises(ValueError):
+            PQube(hostname="127.0.0.1", port=self.device.port,
+                  power_config="3p")
+        with self.assertRaisesRegex(ValueError, "meas_line3"):
+            self.pqube("split_single_phase", meas_line3=True)
+
+    def test_async_update_of_several_devices(self):
+        other = FakePQube()
+        other.start()
+        self.addCleanup(other.stop)
+        other.power_config = PQube3pWye.POWER_CONFIG
+        other.values[7008] = 1.5
+        second = PQube(hostname="127.0.0.1", port=other.port,
+                       power_config="3p_wye", meas_line1=True)
+        self.addCleanup(second.measurements.close)
+        devices = [self.pqube("3p_wye", meas_line1=True).measurements,
+                   second.measurements]
+
+        async def update():
+            try:
+                await async_update_measurements(devices)
+            finally:
+                for device in devices:
+                    device.async_close()
+
+        asyncio.run(update())
+        self.assertEqual([device.line1.v_rms for device in devices],
+                         [7008.5, 1.5])
+
+    def test_async_log(self):
+        p = self.pqube("3p_wye", meas_line1=True, meas_line2=True,
+                       strict_compliance=True)
+
+        async def log():
+            try:
+                return await p.async_pqube_log()
+            finally:
+                p.measurements.async_close()
+
+        answers = len(self.device.in_flight)
+        log = asyncio.run(log())
+        blocks = len(p.measurements._blocks)
+        self.assertEqual(self.device.in_flight[answers:], [1] * blocks)
+        self.assertEqual(log, p.pqube_log())
+
+
+if __name__ == "__main__":
+    unittest.main()